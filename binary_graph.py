@@ -0,0 +1,162 @@
+import mmap
+import json
+import argparse
+import numpy
+
+MAGIC = b'TRGB'
+VERSION = 1
+HEADER = numpy.dtype([
+    ('magic', 'S4'),
+    ('version', '<u4'),
+    ('nodes', '<u8'),
+    ('entries', '<u8'),
+    ('groups', '<u8'),
+])
+# ヘッダに続いて以下の配列を8バイト境界に揃えて格納する
+LAYOUT = [
+    ('node_groups', '<i4', 'nodes'),
+    ('indptr', '<i8', 'nodes+1'),
+    ('indices', '<i4', 'entries'),
+    ('weights', '<f4', 'entries'),
+    ('parents', '<i4', 'groups'),
+]
+
+
+def array_offsets(header):
+    counts = {
+        'nodes': int(header['nodes']),
+        'nodes+1': int(header['nodes']) + 1,
+        'entries': int(header['entries']),
+        'groups': int(header['groups']),
+    }
+    offset = HEADER.itemsize
+    result = []
+    for name, dtype, count in LAYOUT:
+        result.append((name, dtype, counts[count], offset))
+        offset += numpy.dtype(dtype).itemsize * counts[count]
+        offset += -offset % 8
+    return result
+
+
+class BinaryGraph:
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        header = numpy.frombuffer(self.buffer, dtype=HEADER, count=1)[0]
+        if header['magic'] != MAGIC or header['version'] != VERSION:
+            raise ValueError('{} is not a binary graph file'.format(path))
+        for name, dtype, count, offset in array_offsets(header):
+            setattr(self, name, numpy.frombuffer(
+                self.buffer, dtype=dtype, count=count, offset=offset))
+        self.groups = [{'id': i, 'parent': None if p < 0 else int(p)}
+                       for i, p in enumerate(self.parents)]
+
+    def number_of_nodes(self):
+        return len(self.node_groups)
+
+    def group_sizes(self):
+        return numpy.bincount(self.node_groups,
+                              minlength=len(self.parents)).tolist()
+
+    def edge_groups(self):
+        '''各無向辺の両端のグループと辺の重み'''
+        rows = numpy.repeat(numpy.arange(len(self.node_groups)),
+                            numpy.diff(self.indptr))
+        mask = rows < self.indices
+        return (self.node_groups[rows[mask]],
+                self.node_groups[self.indices[mask]],
+                self.weights[mask])
+
+    def regroup(self, group_map):
+        '''ノードのグループを付け替えたグラフ、対応のないノードは-1になる'''
+        # 仮想グループの番号はparentsの範囲を超えることがある
+        size = max([len(self.parents)] + [g + 1 for g in group_map])
+        mapping = numpy.full(size, -1, dtype='<i4')
+        for g, rep in group_map.items():
+            mapping[g] = rep
+        result = BinaryGraph.__new__(BinaryGraph)
+        result.__dict__.update(self.__dict__)
+        result.node_groups = numpy.where(self.node_groups >= 0,
+                                         mapping[self.node_groups], -1)
+        return result
+
+
+def is_binary_graph(path):
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def write_binary_graph(path, node_groups, source, target, weights, parents):
+    n = len(node_groups)
+    source = numpy.asarray(source, dtype='<i8')
+    target = numpy.asarray(target, dtype='<i8')
+    weights = numpy.asarray(weights, dtype='<f4')
+
+    # 無向辺を両方向に格納したCSRを作る
+    loop = source == target
+    rows = numpy.concatenate([source, target[~loop]])
+    cols = numpy.concatenate([target, source[~loop]])
+    weights = numpy.concatenate([weights, weights[~loop]])
+    order = numpy.argsort(rows, kind='stable')
+    indptr = numpy.zeros(n + 1, dtype='<i8')
+    numpy.cumsum(numpy.bincount(rows, minlength=n), out=indptr[1:])
+
+    header = numpy.zeros(1, dtype=HEADER)
+    header['magic'] = MAGIC
+    header['version'] = VERSION
+    header['nodes'] = n
+    header['entries'] = len(rows)
+    header['groups'] = len(parents)
+    arrays = {
+        'node_groups': node_groups,
+        'indptr': indptr,
+        'indices': cols[order],
+        'weights': weights[order],
+        'parents': [-1 if p is None else p for p in parents],
+    }
+    with open(path, 'wb') as f:
+        f.write(header.tobytes())
+        for name, dtype, count, offset in array_offsets(header[0]):
+            f.write(b'\0' * (offset - f.tell()))
+            f.write(numpy.asarray(arrays[name], dtype=dtype).tobytes())
+
+
+def write_node_link(path, graph_data, group_key='group'):
+    nodes = graph_data['nodes']
+    index = {node['id']: i for i, node in enumerate(nodes)}
+    links = graph_data['links']
+    write_binary_graph(
+        path,
+        [node[group_key] for node in nodes],
+        [index[link['source']] for link in links],
+        [index[link['target']] for link in links],
+        [link.get('value', 1) for link in links],
+        [g['parent'] for g in graph_data['groups']])
+
+
+def write_networkx(path, graph, groups):
+    index = {u: i for i, u in enumerate(graph.nodes())}
+    edges = list(graph.edges(data=True))
+    write_binary_graph(
+        path,
+        [graph.node[u]['group'] for u in graph.nodes()],
+        [index[u] for u, _, _ in edges],
+        [index[v] for _, v, _ in edges],
+        [d.get('value', 1) for _, _, d in edges],
+        [g['parent'] for g in groups])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-f', dest='infile', required=True)
+    parser.add_argument('-o', dest='outfile', required=True)
+    parser.add_argument('--group-key', dest='group_key', default='group')
+    args = parser.parse_args()
+
+    write_node_link(args.outfile, json.load(open(args.infile)),
+                    args.group_key)
+
+
+if __name__ == '__main__':
+    main()
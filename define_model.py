@@ -3,6 +3,7 @@ import numpy
 import networkx as nx
 from pyomo.environ import Constraint, ConcreteModel, Objective, Set, Var
 from pyomo.environ import Binary, NonNegativeReals
+from binary_graph import BinaryGraph
 
 
 class Kx:
@@ -103,26 +104,49 @@ class K_group:
 
 
 def cluster_graph(graph):
+    if isinstance(graph, BinaryGraph):
+        return binary_cluster_graph(graph)
     cgraph = nx.Graph()
     groups = {graph.node[u]['group'] for u in graph.nodes()}
     for g in groups:
         cgraph.add_node(g)
-    for g1, g2 in itertools.combinations(groups, 2):
-        weight = len([
-            1 for u, v in graph.edges()
-            if (graph.node[u]['group'] == g1
-                and (graph.node[v]['group'] == g2))
-            or (graph.node[u]['group'] == g2
-                and (graph.node[v]['group'] == g1))
-        ]) / 1000
-        cgraph.add_edge(g1, g2, weight=weight)
+    # 辺の重みはリンクのvalue、なければ1とする
+    for u, v, w in graph.edges(data='value', default=1):
+        g1 = graph.node[u]['group']
+        g2 = graph.node[v]['group']
+        if g1 == g2:
+            continue
+        if cgraph.has_edge(g1, g2):
+            cgraph[g1][g2]['weight'] += w
+        else:
+            cgraph.add_edge(g1, g2, weight=w)
+    for g1, g2 in cgraph.edges():
+        cgraph[g1][g2]['weight'] /= 1000
     return cgraph
 
 
-def edge_weight(graph, K):
+def binary_cluster_graph(graph):
+    cgraph = nx.Graph()
+    groups = numpy.unique(graph.node_groups)
+    for g in groups[groups >= 0]:
+        cgraph.add_node(int(g))
+    g1, g2, weights = graph.edge_groups()
+    mask = (g1 != g2) & (g1 >= 0) & (g2 >= 0)
+    pairs = numpy.column_stack([numpy.minimum(g1, g2)[mask],
+                                numpy.maximum(g1, g2)[mask]])
+    pairs, inverse = numpy.unique(pairs, axis=0, return_inverse=True)
+    totals = numpy.bincount(inverse.ravel(), weights=weights[mask],
+                            minlength=len(pairs))
+    for (g1, g2), total in zip(pairs, totals):
+        cgraph.add_edge(int(g1), int(g2), weight=float(total) / 1000)
+    return cgraph
+
+
+def edge_weight(graph, K, cgraph=None):
     K_id_has_no_children = K.get_id_has_no_children()
-    cgraph = cluster_graph(graph)
-    n = cgraph.number_of_nodes()
+    if cgraph is None:
+        cgraph = cluster_graph(graph)
+    n = len(K_id_has_no_children)
     edges = numpy.zeros((n, n))
     for i, ki in enumerate(K_id_has_no_children):
         gi = K[ki].group
@@ -133,13 +157,15 @@ def edge_weight(graph, K):
     return edges
 
 
-def define_model(graph, K):
+def define_model(graph, K, pairs=None, edges=None, anchors=()):
     # childrenを持つkのid
     K_id_has_children = K.get_id_has_children()
     # childrenを持たないkのid
     K_id_has_no_children = K.get_id_has_no_children()
+    K_index = {k: i for i, k in enumerate(K_id_has_no_children)}
 
-    edges = edge_weight(graph, K)
+    if edges is None:
+        edges = edge_weight(graph, K)
 
     model = ConcreteModel()
     model.K = Set(initialize=K_id_has_children)
@@ -207,8 +233,11 @@ def define_model(graph, K):
                        for j2 in K.neighbors(j1))
                    for j1 in K.ancestors_y(j)) + j_height / 2
 
+    # pairsが与えられた場合はその距離制約のみを生成する
     def D_init(model):
-        return itertools.permutations(K_id_has_no_children, 2)
+        if pairs is None:
+            return itertools.permutations(K_id_has_no_children, 2)
+        return pairs
     model.D = Set(dimen=2, initialize=D_init)
 
     # d_x
@@ -233,12 +262,30 @@ def define_model(graph, K):
                 - model.d_y[k_a, k_b] + model.d_y[k_b, k_a] == 0)
     model.constraint_d_y = Constraint(model.D, rule=d_y_rule)
 
+    # anchors: 位置が固定されたボックスとの辺 (葉のkid, 中心x, 中心y, 重み)
+    model.A = Set(initialize=range(len(anchors)))
+    model.e_x = Var(model.A, [0, 1], within=NonNegativeReals)
+    model.e_y = Var(model.A, [0, 1], within=NonNegativeReals)
+
+    def e_x_rule(model, a):
+        k, x, _, _ = anchors[a]
+        return (get_x_coord(model, k, K[k].parent.kid) - x
+                - model.e_x[a, 0] + model.e_x[a, 1] == 0)
+    model.constraint_e_x = Constraint(model.A, rule=e_x_rule)
+
+    def e_y_rule(model, a):
+        k, _, y, _ = anchors[a]
+        return (get_y_coord(model, k, K[k].parent.kid) - y
+                - model.e_y[a, 0] + model.e_y[a, 1] == 0)
+    model.constraint_e_y = Constraint(model.A, rule=e_y_rule)
+
     def obj_expression(model):
-        return sum((edges[a][b] * model.d_x[(k_a, k_b)]
-                   + edges[a][b] * model.d_y[(k_a, k_b)])
-                   for a, k_a in enumerate(K_id_has_no_children)
-                   for b, k_b in enumerate(K_id_has_no_children)
-                   if k_a != k_b)
+        return sum(edges[K_index[k_a]][K_index[k_b]]
+                   * (model.d_x[(k_a, k_b)] + model.d_y[(k_a, k_b)])
+                   for k_a, k_b in model.D) + sum(
+            anchors[a][3] * (model.e_x[a, 0] + model.e_x[a, 1]
+                             + model.e_y[a, 0] + model.e_y[a, 1])
+            for a in model.A)
     model.OBJ = Objective(rule=obj_expression)
 
     return model
@@ -4,6 +4,7 @@ import itertools
 import argparse
 import networkx as nx
 from networkx.readwrite import json_graph
+from binary_graph import write_networkx
 
 
 def make_graph(m, pgroup, pout, pin=0.2, pbridge=0.05, nmin=10, nmax=30):
@@ -42,14 +43,20 @@ def main():
     parser.add_argument('--pgroup', dest='pgroup', type=float, required=True)
     parser.add_argument('--pout', dest='pout', type=float, required=True)
     parser.add_argument('-o', dest='outfile', required=True)
+    parser.add_argument('--format', dest='format', default='json',
+                        choices=['json', 'binary'])
     args = parser.parse_args()
 
     m = args.m
     graph = make_graph(m=m, pgroup=args.pgroup, pout=args.pout)
-    data = json_graph.node_link_data(graph)
-    data['groups'] = [{'id': i, 'parent': m} for i in range(m)]
-    data['groups'].append({'id': m, 'parent': None})
-    json.dump(data, open(args.outfile, 'w'))
+    groups = [{'id': i, 'parent': m} for i in range(m)]
+    groups.append({'id': m, 'parent': None})
+    if args.format == 'binary':
+        write_networkx(args.outfile, graph, groups)
+    else:
+        data = json_graph.node_link_data(graph)
+        data['groups'] = groups
+        json.dump(data, open(args.outfile, 'w'))
 
 
 if __name__ == '__main__':
@@ -2,6 +2,7 @@ import json
 import argparse
 import networkx as nx
 from networkx.readwrite import json_graph
+from binary_graph import write_networkx
 import community
 
 
@@ -19,14 +20,20 @@ def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('-n', dest='n', type=int, required=True)
     parser.add_argument('-o', dest='outfile', required=True)
+    parser.add_argument('--format', dest='format', default='json',
+                        choices=['json', 'binary'])
     args = parser.parse_args()
 
     graph = make_graph(args.n)
     m = len({graph.node[u]['group'] for u in graph.nodes()})
-    data = json_graph.node_link_data(graph)
-    data['groups'] = [{'id': i, 'parent': m} for i in range(m)]
-    data['groups'].append({'id': m, 'parent': None})
-    json.dump(data, open(args.outfile, 'w'))
+    groups = [{'id': i, 'parent': m} for i in range(m)]
+    groups.append({'id': m, 'parent': None})
+    if args.format == 'binary':
+        write_networkx(args.outfile, graph, groups)
+    else:
+        data = json_graph.node_link_data(graph)
+        data['groups'] = groups
+        json.dump(data, open(args.outfile, 'w'))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,146 @@
+import os
+import json
+import tempfile
+from contextlib import contextmanager
+import numpy
+
+FORMATS = ['json', 'ndjson', 'npz', 'arrow']
+GROUP_FIELDS = ['x', 'y', 'dx', 'dy']
+
+
+@contextmanager
+def atomic_write(path, mode='w'):
+    '''一時ファイルに書き込み、成功した場合のみpathへ置き換える'''
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, temp = tempfile.mkstemp(dir=directory, suffix='.tmp',
+                                prefix='.' + os.path.basename(path))
+    try:
+        with os.fdopen(fd, mode) as f:
+            yield f
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(temp, 0o666 & ~umask)
+        os.replace(temp, path)
+    except BaseException:
+        os.unlink(temp)
+        raise
+
+
+def group_columns(groups):
+    columns = {
+        'id': numpy.array([g.get('id', i) for i, g in enumerate(groups)]),
+        'parent': numpy.array([-1 if g['parent'] is None else g['parent']
+                               for g in groups]),
+    }
+    for key in GROUP_FIELDS:
+        columns[key] = numpy.array([g.get(key, numpy.nan) for g in groups],
+                                   dtype=float)
+    return columns
+
+
+def node_columns(nodes):
+    '''ノード座標の列、座標を持たない場合はNone'''
+    if not any('x' in node for node in nodes):
+        return None
+    return {
+        'group': numpy.array([node['group'] for node in nodes]),
+        'x': numpy.array([node.get('x', numpy.nan) for node in nodes],
+                         dtype=float),
+        'y': numpy.array([node.get('y', numpy.nan) for node in nodes],
+                         dtype=float),
+    }
+
+
+def nodes_path(path):
+    root, ext = os.path.splitext(path)
+    return root + '.nodes' + ext
+
+
+class GeometryStream:
+    '''確定したグループから順に1行1オブジェクトで書き出す
+
+    atomicがFalseの場合は書き込み中のファイルを読み進められる
+    '''
+
+    def __init__(self, path, atomic=True):
+        if atomic:
+            self.context = atomic_write(path)
+            self.file = self.context.__enter__()
+        else:
+            self.context = None
+            self.file = open(path, 'w')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        if self.context is None:
+            self.file.close()
+            return False
+        return self.context.__exit__(*exc)
+
+    def write_group(self, i, group):
+        record = {'type': 'group', 'id': group.get('id', i),
+                  'parent': group['parent']}
+        for key in GROUP_FIELDS:
+            record[key] = group[key]
+        self.file.write(json.dumps(record) + '\n')
+
+    def write_node(self, i, node):
+        record = {'type': 'node', 'index': i, 'group': node['group'],
+                  'x': node['x'], 'y': node['y']}
+        self.file.write(json.dumps(record) + '\n')
+
+    def flush(self):
+        self.file.flush()
+
+
+def write_ndjson(path, graph_data):
+    with GeometryStream(path) as stream:
+        for i, group in enumerate(graph_data['groups']):
+            if 'x' in group:
+                stream.write_group(i, group)
+        for i, node in enumerate(graph_data.get('nodes', [])):
+            if 'x' in node:
+                stream.write_node(i, node)
+
+
+def write_npz(path, graph_data):
+    arrays = {'group_' + key: value for key, value
+              in group_columns(graph_data['groups']).items()}
+    nodes = node_columns(graph_data.get('nodes', []))
+    if nodes is not None:
+        arrays.update({'node_' + key: value for key, value in nodes.items()})
+    with atomic_write(path, 'wb') as f:
+        numpy.savez(f, **arrays)
+
+
+def write_arrow(path, graph_data):
+    import pyarrow
+    import pyarrow.ipc
+
+    def write_table(path, columns):
+        table = pyarrow.Table.from_pydict(columns)
+        with atomic_write(path, 'wb') as f:
+            with pyarrow.ipc.new_file(f, table.schema) as writer:
+                writer.write_table(table)
+
+    write_table(path, group_columns(graph_data['groups']))
+    nodes = node_columns(graph_data.get('nodes', []))
+    if nodes is not None:
+        write_table(nodes_path(path), nodes)
+
+
+def write_json(path, graph_data):
+    with atomic_write(path) as f:
+        json.dump(graph_data, f)
+
+
+def write_layout(path, graph_data, output_format='json'):
+    writers = {
+        'json': write_json,
+        'ndjson': write_ndjson,
+        'npz': write_npz,
+        'arrow': write_arrow,
+    }
+    writers[output_format](path, graph_data)
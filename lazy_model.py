@@ -0,0 +1,80 @@
+import numpy
+from define_model import define_model, edge_weight, get_x_coord, get_y_coord
+
+
+def leaf_centers(K, model):
+    leaves = K.get_id_has_no_children()
+    x = numpy.array([get_x_coord(K, model, k) + K[k].width / 2
+                     for k in leaves])
+    y = numpy.array([get_y_coord(K, model, k) + K[k].height / 2
+                     for k in leaves])
+    return x, y
+
+
+def anchor_costs(K, x, y, anchors):
+    position = {k: i for i, k in enumerate(K.get_id_has_no_children())}
+    return sum(w * (abs(x[position[k]] - ax) + abs(y[position[k]] - ay))
+               for k, ax, ay, w in anchors)
+
+
+def warm_start(model, previous, K, anchors=()):
+    x, y = leaf_centers(K, previous)
+    position = {k: i for i, k in enumerate(K.get_id_has_no_children())}
+    for index in model.x:
+        model.x[index].value = previous.x[index].value
+    for index in model.l:
+        model.l[index].value = previous.l[index].value
+    for a, b in model.D:
+        model.d_x[a, b].value = max(x[position[a]] - x[position[b]], 0)
+        model.d_y[a, b].value = max(y[position[a]] - y[position[b]], 0)
+    for a, (k, ax, ay, _) in enumerate(anchors):
+        model.e_x[a, 0].value = max(x[position[k]] - ax, 0)
+        model.e_x[a, 1].value = max(ax - x[position[k]], 0)
+        model.e_y[a, 0].value = max(y[position[k]] - ay, 0)
+        model.e_y[a, 1].value = max(ay - y[position[k]], 0)
+
+
+def solve_lazy(graph, K, solver, initial_pairs=100, step=100, tol=1e-6,
+               max_iter=100, edges=None, anchors=(), **options):
+    leaves = K.get_id_has_no_children()
+    if edges is None:
+        edges = edge_weight(graph, K)
+    iu, ju = numpy.triu_indices(len(leaves), 1)
+    weights = edges[iu, ju]
+
+    # 重みが0のペアは目的関数に寄与しないので候補から除外する
+    candidates = numpy.nonzero(weights > 0)[0]
+    order = candidates[numpy.argsort(-weights[candidates], kind='stable')]
+    active = numpy.zeros(len(weights), dtype=bool)
+    active[order[:initial_pairs]] = True
+
+    model = None
+    results = []
+    for _ in range(max_iter):
+        pairs = [(leaves[iu[p]], leaves[ju[p]])
+                 for p in numpy.nonzero(active)[0]]
+        pairs += [(b, a) for a, b in pairs]
+        previous = model
+        model = define_model(graph, K, pairs=pairs, edges=edges,
+                             anchors=anchors)
+        if previous is not None:
+            warm_start(model, previous, K, anchors)
+        result = solver.solve(model, warmstart=previous is not None,
+                              **options)
+        results.append(result)
+
+        # 現在の順序での真の目的関数値と省略したペアの寄与
+        x, y = leaf_centers(K, model)
+        costs = weights * (numpy.abs(x[iu] - x[ju])
+                           + numpy.abs(y[iu] - y[ju]))
+        upper_bound = costs.sum() + anchor_costs(K, x, y, anchors)
+        lower_bound = result.problem.lower_bound
+        omitted = numpy.nonzero(~active & (costs > 0))[0]
+        print('lazy: {} pairs, bound [{}, {}]'.format(
+            active.sum(), lower_bound, upper_bound))
+        if len(omitted) == 0 or upper_bound - lower_bound <= tol * max(
+                1, abs(upper_bound)):
+            break
+        added = omitted[numpy.argsort(-costs[omitted], kind='stable')[:step]]
+        active[added] = True
+    return model, results
@@ -0,0 +1,78 @@
+from define_model import cluster_graph
+
+
+def sibling_weights(cgraph, children, parent):
+    # 各グループをparentの子のうち自身を含むものへ対応付ける
+    rep = {}
+
+    def rec(g, r):
+        rep[g] = r
+        for c in children[g]:
+            rec(c, r)
+
+    for c in children[parent]:
+        rec(c, c)
+    weights = {}
+    for g1, g2, w in cgraph.edges(data='weight'):
+        r1 = rep.get(g1)
+        r2 = rep.get(g2)
+        if r1 is None or r2 is None or r1 == r2:
+            continue
+        key = (min(r1, r2), max(r1, r2))
+        weights[key] = weights.get(key, 0) + w
+    return weights
+
+
+def match(members, weights, sizes, count):
+    '''重い辺から順に最大count組のグループを対にする'''
+    matched = set()
+    pairs = []
+    for (a, b), _ in sorted(weights.items(), key=lambda item: -item[1]):
+        if len(pairs) == count:
+            return pairs
+        if a not in matched and b not in matched:
+            matched.update((a, b))
+            pairs.append((a, b))
+    # 接続のないグループは小さいもの同士を対にする
+    rest = sorted([g for g in members if g not in matched],
+                  key=lambda g: sizes[g])
+    pairs.extend(zip(rest[0::2], rest[1::2]))
+    return pairs[:count]
+
+
+def coarsen(graph, sizes, children, max_children):
+    '''子の多いグループの下に仮想的なグループを挿入する
+
+    sizesとchildrenは仮想グループの分だけ拡張され、仮想グループの番号を返す
+    '''
+    if max_children < 2:
+        raise ValueError('max_children must be at least 2')
+    cgraph = cluster_graph(graph)
+    virtual = []
+    for p in range(len(children)):
+        if len(children[p]) <= max_children:
+            continue
+        members = list(children[p])
+        weights = sibling_weights(cgraph, children, p)
+        while len(members) > max_children:
+            pairs = match(members, weights, sizes,
+                          len(members) - max_children)
+            rep = {g: g for g in members}
+            for a, b in pairs:
+                v = len(children)
+                children.append(sorted([a, b], key=lambda k: sizes[k],
+                                       reverse=True))
+                sizes.append(sizes[a] + sizes[b])
+                virtual.append(v)
+                rep[a] = rep[b] = v
+            members = list({rep[g]: None for g in members})
+            coarse = {}
+            for (a, b), w in weights.items():
+                a = rep[a]
+                b = rep[b]
+                if a != b:
+                    key = (min(a, b), max(a, b))
+                    coarse[key] = coarse.get(key, 0) + w
+            weights = coarse
+        children[p] = sorted(members, key=lambda k: sizes[k], reverse=True)
+    return virtual
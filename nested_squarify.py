@@ -23,7 +23,7 @@ def aggregate_sizes(groups, sizes, children, visited):
         rec(k)
 
 
-def nested_squarify(sizes, children, x, y, dx, dy):
+def nested_squarify(sizes, children, x, y, dx, dy, root=None):
     result = [{} for _ in sizes]
 
     def rec(parent, x, y, dx, dy, level):
@@ -39,11 +39,12 @@ def nested_squarify(sizes, children, x, y, dx, dy):
                 result[child][key] = g[key]
             rec(child, g['x'], g['y'], g['dx'], g['dy'], level + 1)
 
-    visited = set()
-    for l in children:
-        for c in l:
-            visited.add(c)
-    root = [i for i in range(len(children)) if i not in visited][0]
+    if root is None:
+        visited = set()
+        for l in children:
+            for c in l:
+                visited.add(c)
+        root = [i for i in range(len(children)) if i not in visited][0]
     result[root]['x'] = x
     result[root]['y'] = y
     result[root]['dx'] = dx
@@ -58,18 +59,28 @@ def nested_tree_structure(boxes, children):
     tiles = []
     tile_ids = {}
     offset = 0
-    for p, l in enumerate(children):
-        if not l:
-            continue
-        tree = tree_structure([boxes[c] for c in l], offset)
-        for i, t in enumerate(tree):
-            if 'box_id' in t:
-                t['box_id'] = l[t['box_id']]
-                tile_ids[t['box_id']] = i + offset
-            if t['parent'] is None and p in tile_ids:
-                t['parent'] = tile_ids[p]
-            tiles.append(t)
-        offset += len(tree)
+    # 親のタイルが先に生成されるよう、未生成の親を持つものは後回しにする
+    nested = {c for l in children for c in l}
+    pending = [p for p, l in enumerate(children) if l]
+    while pending:
+        remaining = []
+        for p in pending:
+            if p in nested and p not in tile_ids:
+                remaining.append(p)
+                continue
+            l = children[p]
+            tree = tree_structure([boxes[c] for c in l], offset)
+            for i, t in enumerate(tree):
+                if 'box_id' in t:
+                    t['box_id'] = l[t['box_id']]
+                    tile_ids[t['box_id']] = i + offset
+                if t['parent'] is None and p in tile_ids:
+                    t['parent'] = tile_ids[p]
+                tiles.append(t)
+            offset += len(tree)
+        if len(remaining) == len(pending):
+            break
+        pending = remaining
     return tiles
 
 
@@ -0,0 +1,163 @@
+from concurrent.futures import ProcessPoolExecutor
+import numpy
+
+
+def grid_pairs(pos, cell, limit, random):
+    # 同じセルと隣接するセルに含まれるノードの組を列挙する
+    # 各セルからはlimit個までのノードを無作為に選び、重みで補正する
+    n = len(pos)
+    lower = pos.min(axis=0)
+    nx, ny = (pos.max(axis=0) - lower) // cell + 1
+    nx = int(nx)
+    ny = int(ny)
+    cx = ((pos[:, 0] - lower[0]) // cell).astype(int)
+    cy = ((pos[:, 1] - lower[1]) // cell).astype(int)
+    cid = cx * ny + cy
+    order = numpy.lexsort((random.rand(n), cid))
+    counts = numpy.bincount(cid, minlength=nx * ny)
+    start = numpy.cumsum(counts) - counts
+    rows = []
+    cols = []
+    weights = []
+    for ox in (-1, 0, 1):
+        for oy in (-1, 0, 1):
+            tx = cx + ox
+            ty = cy + oy
+            valid = (tx >= 0) & (tx < nx) & (ty >= 0) & (ty < ny)
+            target = numpy.where(valid, tx * ny + ty, 0)
+            c = numpy.where(valid, numpy.minimum(counts[target], limit), 0)
+            offsets = (numpy.arange(c.sum())
+                       - numpy.repeat(numpy.cumsum(c) - c, c))
+            rows.append(numpy.repeat(numpy.arange(n), c))
+            cols.append(order[numpy.repeat(start[target], c) + offsets])
+            weights.append(numpy.repeat(counts[target] / numpy.maximum(c, 1),
+                                        c))
+    rows = numpy.concatenate(rows)
+    cols = numpy.concatenate(cols)
+    weights = numpy.concatenate(weights)
+    mask = rows != cols
+    return rows[mask], cols[mask], weights[mask]
+
+
+def layout_group(box, edges, anchors, iterations=50, pull=0.1, limit=16,
+                 seed=None):
+    x, y, dx, dy = box
+    n = len(anchors)
+    if n < 2 or dx * dy <= 0:
+        # 面積のないボックスではノードを中心に置く
+        return numpy.array([[x + dx / 2, y + dy / 2]] * n)
+    random = numpy.random.RandomState(seed)
+    pos = numpy.column_stack([x + random.rand(n) * dx,
+                              y + random.rand(n) * dy])
+    k = numpy.sqrt(dx * dy / n)
+    anchored = ~numpy.isnan(anchors[:, 0])
+    u = edges[:, 0]
+    v = edges[:, 1]
+    t0 = max(dx, dy) / 10
+    t = t0
+    for step in range(iterations):
+        disp = numpy.zeros((n, 2))
+
+        # 斥力: 2kより離れたノードの組は無視する
+        rows, cols, weights = grid_pairs(pos, 2 * k, limit, random)
+        delta = pos[rows] - pos[cols]
+        dist2 = (delta ** 2).sum(axis=1)
+        # 重なったノードはランダムな方向へ離す
+        overlap = dist2 < 1e-9 * k * k
+        delta[overlap] = (random.rand(overlap.sum(), 2) - 0.5) * 1e-3 * k
+        dist2 = numpy.maximum((delta ** 2).sum(axis=1), 1e-12)
+        force = delta * (weights * k * k / dist2)[:, None]
+        for axis in range(2):
+            disp[:, axis] += numpy.bincount(rows, weights=force[:, axis],
+                                            minlength=n)
+
+        # 引力
+        delta = pos[u] - pos[v]
+        dist = numpy.sqrt((delta ** 2).sum(axis=1))
+        force = delta * (dist / k)[:, None]
+        for axis in range(2):
+            disp[:, axis] -= numpy.bincount(u, weights=force[:, axis],
+                                            minlength=n)
+            disp[:, axis] += numpy.bincount(v, weights=force[:, axis],
+                                            minlength=n)
+
+        # 接続するグループに面した辺へ引き寄せる
+        # 引力と同じくd^2/kに比例させ、グループの大きさによらず効かせる
+        delta = anchors[anchored] - pos[anchored]
+        dist = numpy.sqrt((delta ** 2).sum(axis=1))
+        disp[anchored] += pull * delta * (dist / k)[:, None]
+
+        length = numpy.maximum(numpy.sqrt((disp ** 2).sum(axis=1)), 1e-9)
+        pos += disp * (numpy.minimum(length, t) / length)[:, None]
+        pos[:, 0] = numpy.clip(pos[:, 0], x, x + dx)
+        pos[:, 1] = numpy.clip(pos[:, 1], y, y + dy)
+        t = t0 * (1 - (step + 1) / iterations)
+    return pos
+
+
+def layout_nodes(graph_data, processes=None, iterations=50, padding=0.05,
+                 seed=None):
+    groups = graph_data['groups']
+    nodes = graph_data['nodes']
+    index = {node['id']: i for i, node in enumerate(nodes)}
+    node_groups = numpy.array([node['group'] for node in nodes], dtype=int)
+    links = graph_data['links']
+    source = numpy.array([index[link['source']] for link in links],
+                         dtype=int)
+    target = numpy.array([index[link['target']] for link in links],
+                         dtype=int)
+
+    boxes = numpy.array([[g['x'], g['y'], g['dx'], g['dy']]
+                         if 'x' in g else [0, 0, 0, 0] for g in groups],
+                        dtype=float)
+    # 余白で縮めた結果負になったボックスは大きさ0とする
+    boxes[:, 2:] = numpy.maximum(boxes[:, 2:], 0)
+    boxes[:, 0] += boxes[:, 2] * padding
+    boxes[:, 1] += boxes[:, 3] * padding
+    boxes[:, 2:] *= 1 - 2 * padding
+    centers = boxes[:, :2] + boxes[:, 2:] / 2
+
+    # 他のグループへの辺を持つノードは接続先のグループの中心に最も近い
+    # 自グループのボックス内の点を目標とする
+    n = len(nodes)
+    external = node_groups[source] != node_groups[target]
+    u = numpy.concatenate([source[external], target[external]])
+    v = numpy.concatenate([target[external], source[external]])
+    count = numpy.bincount(u, minlength=n)
+    anchors = numpy.full((n, 2), numpy.nan)
+    for axis in range(2):
+        total = numpy.bincount(u, weights=centers[node_groups[v], axis],
+                               minlength=n)
+        lower = boxes[node_groups, axis]
+        upper = lower + boxes[node_groups, axis + 2]
+        has_anchor = count > 0
+        anchors[has_anchor, axis] = numpy.clip(
+            total[has_anchor] / count[has_anchor],
+            lower[has_anchor], upper[has_anchor])
+
+    # グループごとにノードと内部の辺を分割する
+    order = numpy.argsort(node_groups, kind='stable')
+    keys, first = numpy.unique(node_groups[order], return_index=True)
+    members = numpy.split(order, first[1:])
+    local = numpy.zeros(n, dtype=int)
+    for member in members:
+        local[member] = numpy.arange(len(member))
+    internal = numpy.nonzero(~external)[0]
+    internal = internal[numpy.argsort(node_groups[source[internal]],
+                                      kind='stable')]
+    bounds = numpy.searchsorted(node_groups[source[internal]], keys)
+    tasks = []
+    for g, member, edge_ids in zip(keys, members,
+                                   numpy.split(internal, bounds[1:])):
+        edges = numpy.column_stack([local[source[edge_ids]],
+                                    local[target[edge_ids]]])
+        tasks.append((tuple(boxes[g]), edges, anchors[member], iterations,
+                      0.1, 16, None if seed is None else seed + int(g)))
+
+    with ProcessPoolExecutor(processes) as executor:
+        results = executor.map(layout_group, *zip(*tasks))
+        for member, pos in zip(members, results):
+            for i, (px, py) in zip(member, pos):
+                nodes[i]['x'] = float(px)
+                nodes[i]['y'] = float(py)
+    return graph_data
@@ -0,0 +1,182 @@
+import json
+import time
+import argparse
+import networkx as nx
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+from networkx.readwrite import json_graph
+from trgib import prepare, find_root, subtree_groups, anchor_groups
+from trgib import layout_subtree, apply_boxes
+from layout_writer import FORMATS, GeometryStream, write_layout
+
+
+class ProgressiveLayout:
+
+    def __init__(self, graph_data, width, height, levels=1, **options):
+        if levels < 1:
+            raise ValueError('levels must be at least 1')
+        self.graph_data = graph_data
+        self.graph = json_graph.node_link_graph(graph_data)
+        self.groups = graph_data['groups']
+        self.sizes, self.children = prepare(graph_data)
+        self.levels = levels
+        self.options = options
+        self.root = find_root(self.groups)
+        # 部分木ごとにグラフを切り出すためのグループ別のノード
+        self.members = [[] for _ in self.groups]
+        for u in self.graph.nodes():
+            self.members[self.graph.node[u]['group']].append(u)
+        self.boxes = {self.root: {
+            'x': 0,
+            'y': 0,
+            'dx': width,
+            'dy': height,
+            'level': 0,
+        }}
+        self.expanded = set()
+
+    def frontier(self):
+        '''配置済みで子孫がまだ配置されていないグループ'''
+        return [g for g in self.boxes
+                if self.children[g] and g not in self.expanded]
+
+    def subgraph(self, g):
+        '''グループgの部分木のノードと、それに接続する部分木の外のノード
+
+        外のノードは含まれる配置済みのグループに付け替え、向きを決める
+        固定されたボックスとして扱わせる
+        '''
+        inside, _ = subtree_groups(self.children, g)
+        anchor_map = anchor_groups(self.children, g, self.boxes)
+        graph = nx.Graph()
+        for h in inside:
+            for u in self.members[h]:
+                graph.add_node(u, group=h)
+        for h in inside:
+            for u in self.members[h]:
+                for v, data in self.graph[u].items():
+                    if not graph.has_node(v):
+                        anchor = anchor_map.get(self.graph.node[v]['group'])
+                        if anchor is None:
+                            continue
+                        graph.add_node(v, group=anchor)
+                    graph.add_edge(u, v, value=data.get('value', 1))
+        return graph
+
+    def arguments(self, g):
+        box = self.boxes[g]
+        graph = self.subgraph(g)
+        return (graph, self.sizes, self.children, g,
+                box['x'], box['y'], box['dx'], box['dy'], self.levels,
+                (), self.boxes)
+
+    def merge(self, g, boxes):
+        level = self.boxes[g]['level']
+        for h, box in boxes.items():
+            box['level'] += level
+            self.boxes[h] = box
+        _, expanded = subtree_groups(self.children, g, self.levels)
+        self.expanded.update(expanded)
+
+    def expand(self, g):
+        '''グループgの子孫をlevels階層分配置する'''
+        if g not in self.boxes:
+            self.expand(self.groups[g]['parent'])
+        if g in self.expanded or not self.children[g]:
+            return
+        boxes, _ = layout_subtree(*self.arguments(g), **self.options)
+        self.merge(g, boxes)
+
+    def expand_all(self, workers=None, callback=None):
+        with ProcessPoolExecutor(workers) as executor:
+            pending = {}
+            while True:
+                running = set(pending.values())
+                for g in self.frontier():
+                    if g not in running:
+                        future = executor.submit(layout_subtree,
+                                                 *self.arguments(g),
+                                                 **self.options)
+                        pending[future] = g
+                if not pending:
+                    break
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    g = pending.pop(future)
+                    boxes, _ = future.result()
+                    self.merge(g, boxes)
+                if callback is not None:
+                    callback(self)
+
+    def result(self):
+        apply_boxes(self.groups, self.boxes)
+        return self.graph_data
+
+    def write(self, outfile, output_format='json'):
+        write_layout(outfile, self.result(), output_format)
+
+    def stream(self, stream, written):
+        '''まだ書き出していない配置済みのグループを書き出す'''
+        self.result()
+        for g in self.boxes:
+            if g not in written:
+                stream.write_group(g, self.groups[g])
+                written.add(g)
+        stream.flush()
+
+
+def throttle(write, interval):
+    '''前回からinterval秒以上経過した場合のみwriteを呼ぶコールバック'''
+    last = [time.monotonic()]
+
+    def callback(layout):
+        now = time.monotonic()
+        if now - last[0] >= interval:
+            write(layout)
+            last[0] = now
+    return callback
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--width', dest='width', type=int, default=800)
+    parser.add_argument('--height', dest='height', type=int, default=600)
+    parser.add_argument('-f', dest='infile', required=True)
+    parser.add_argument('-o', dest='outfile', required=True)
+    parser.add_argument('--group-key', dest='group_key', default='group')
+    parser.add_argument('--format', dest='format', default='json',
+                        choices=FORMATS)
+    parser.add_argument('--levels', dest='levels', type=int, default=1)
+    parser.add_argument('--workers', dest='workers', type=int)
+    parser.add_argument('--no-expand', dest='expand', action='store_false')
+    parser.add_argument('--interval', dest='interval', type=float,
+                        default=5)
+    args = parser.parse_args()
+    if args.levels < 1:
+        parser.error('--levels must be at least 1')
+
+    graph = json.load(open(args.infile))
+    for node in graph['nodes']:
+        node['group'] = node[args.group_key]
+    layout = ProgressiveLayout(graph, args.width, args.height, args.levels)
+    layout.expand(layout.root)
+    if args.format == 'ndjson':
+        # 書き込み中のファイルを読み進められるよう直接書き出す
+        written = set()
+        with GeometryStream(args.outfile, atomic=False) as stream:
+            layout.stream(stream, written)
+            if args.expand:
+                layout.expand_all(
+                    args.workers,
+                    callback=lambda layout: layout.stream(stream, written))
+        return
+    layout.write(args.outfile, args.format)
+    if args.expand:
+        # ファイル全体を書き直すので途中結果の書き出しは間引く
+        layout.expand_all(args.workers, callback=throttle(
+            lambda layout: layout.write(args.outfile, args.format),
+            args.interval))
+        layout.write(args.outfile, args.format)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,348 @@
+import os
+import json
+import signal
+import asyncio
+import hashlib
+import argparse
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qs
+from pyomo.opt import SolverFactory
+from trgib import run
+
+
+STATUS_TEXT = {
+    200: 'OK',
+    202: 'Accepted',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed',
+    500: 'Internal Server Error',
+    503: 'Service Unavailable',
+}
+# 読み込み済みのモジュールを引き継ぐためforkでジョブを起動する
+CONTEXT = multiprocessing.get_context('fork')
+
+
+def warm_up():
+    # CBCの存在確認を事前に行っておく
+    SolverFactory('cbc').available()
+
+
+def load_graph(body, group_key):
+    '''リクエストの本文を検証してグラフを読み込む'''
+    graph_data = json.loads(body)
+    groups = graph_data['groups']
+
+    def valid(g):
+        return type(g) is int and 0 <= g < len(groups)
+
+    if not any(g['parent'] is None for g in groups):
+        raise ValueError('no root group')
+    for g in groups:
+        if g['parent'] is not None and not valid(g['parent']):
+            raise ValueError('invalid parent: {!r}'.format(g['parent']))
+    for node in graph_data['nodes']:
+        node['group'] = node[group_key]
+        if not valid(node['group']):
+            raise ValueError('invalid group: {!r}'.format(node['group']))
+    return graph_data
+
+
+def layout_job(graph_data, width, height, options):
+    timings = {}
+    result = run(graph_data, width, height, timings=timings, tee=False,
+                 **options)
+    return json.dumps(result).encode(), timings
+
+
+def layout_process(conn, body, width, height, group_key, options):
+    # CBCごと終了できるよう独立したプロセスグループで実行する
+    os.setpgrp()
+    try:
+        try:
+            graph_data = load_graph(body, group_key)
+        except (ValueError, KeyError, TypeError) as e:
+            conn.send(('invalid', repr(e)))
+            return
+        try:
+            conn.send(('done', layout_job(graph_data, width, height,
+                                          options)))
+        except Exception as e:
+            conn.send(('failed', repr(e)))
+    finally:
+        conn.close()
+
+
+def wait_process(process, conn):
+    try:
+        message = conn.recv()
+    except EOFError:
+        message = ('failed', 'worker exited with {}'.format(process.exitcode))
+    finally:
+        conn.close()
+    process.join()
+    return message
+
+
+class Job:
+
+    def __init__(self, job_id, body, width, height, group_key, options):
+        self.id = job_id
+        self.body = body
+        self.width = width
+        self.height = height
+        self.group_key = group_key
+        self.options = options
+        self.status = 'queued'
+        self.result = None
+        self.error = None
+        self.code = 200
+        self.process = None
+        self.done = asyncio.Event()
+
+    def finish(self, status, result=None, error=None, code=200):
+        self.status = status
+        self.result = result
+        self.error = error
+        self.code = code
+        self.body = None
+        self.done.set()
+
+    def describe(self):
+        return {'id': self.id, 'status': self.status, 'error': self.error}
+
+
+class LayoutServer:
+
+    def __init__(self, workers=1, queue_size=16, keep=100):
+        # ジョブのプロセスの終了を待つスレッド
+        self.executor = ThreadPoolExecutor(workers)
+        self.workers = workers
+        self.queue = asyncio.Queue(queue_size)
+        self.jobs = OrderedDict()
+        self.keep = keep
+        self.running = 0
+        self.latencies = {}
+
+    def start(self):
+        warm_up()
+        for _ in range(self.workers):
+            asyncio.ensure_future(self.worker())
+
+    async def worker(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            job = await self.queue.get()
+            if job.status == 'cancelled':
+                continue
+            job.status = 'running'
+            self.running += 1
+            receiver = None
+            try:
+                receiver, sender = CONTEXT.Pipe(duplex=False)
+                process = CONTEXT.Process(
+                    target=layout_process,
+                    args=(sender, job.body, job.width, job.height,
+                          job.group_key, job.options))
+                try:
+                    process.start()
+                finally:
+                    sender.close()
+                job.process = process
+                status, value = await loop.run_in_executor(
+                    self.executor, wait_process, process, receiver)
+            except Exception as e:
+                # プロセスを起動できなくてもジョブを失敗させてワーカーは続ける
+                if receiver is not None:
+                    receiver.close()
+                status, value = 'failed', repr(e)
+            finally:
+                self.running -= 1
+            # キャンセル済みのジョブの結果は破棄する
+            if job.status == 'cancelled':
+                pass
+            elif status == 'done':
+                result, timings = value
+                for name, t in timings.items():
+                    self.record(name, t)
+                job.finish('done', result=result)
+            else:
+                # 入力の誤りとサーバ側の失敗を区別する
+                code = 400 if status == 'invalid' else 500
+                job.finish('failed', error=value, code=code)
+            self.evict()
+
+    def record(self, name, t):
+        latency = self.latencies.setdefault(
+            name, {'count': 0, 'total': 0, 'max': 0})
+        latency['count'] += 1
+        latency['total'] += t
+        latency['max'] = max(latency['max'], t)
+
+    def evict(self):
+        finished = [job_id for job_id, job in self.jobs.items()
+                    if job.done.is_set()]
+        for job_id in finished[:max(len(finished) - self.keep, 0)]:
+            del self.jobs[job_id]
+
+    def submit(self, body, width, height, group_key, options):
+        key = json.dumps([width, height, group_key, options], sort_keys=True)
+        job_id = hashlib.sha256(key.encode() + body).hexdigest()
+        job = self.jobs.get(job_id)
+        # 同一の入力は実行中または完了済みのジョブを共有する
+        if job is not None and job.status not in ('failed', 'cancelled'):
+            return job
+        job = Job(job_id, body, width, height, group_key, options)
+        self.queue.put_nowait(job)
+        self.jobs[job_id] = job
+        return job
+
+    def cancel(self, job):
+        if job.done.is_set():
+            return
+        if job.process is not None:
+            # 実行中のジョブはCBCを含むプロセスグループごと終了する
+            try:
+                os.killpg(job.process.pid, signal.SIGKILL)
+            except ProcessLookupError:
+                job.process.kill()
+        job.finish('cancelled')
+
+    def shutdown(self):
+        for job in self.jobs.values():
+            self.cancel(job)
+        self.executor.shutdown()
+
+    def stats(self):
+        return {
+            'queue': self.queue.qsize(),
+            'running': self.running,
+            'jobs': len(self.jobs),
+            'latency': {
+                name: {
+                    'count': latency['count'],
+                    'mean': latency['total'] / latency['count'],
+                    'max': latency['max'],
+                } for name, latency in self.latencies.items()
+            },
+        }
+
+    async def handle(self, reader, writer):
+        try:
+            try:
+                request = await read_request(reader, writer)
+            except (ValueError, asyncio.IncompleteReadError):
+                await write_response(writer, 400, {'error': 'bad request'})
+                return
+            if request is not None:
+                status, body = await self.dispatch(*request)
+                await write_response(writer, status, body)
+        finally:
+            writer.close()
+
+    async def dispatch(self, method, target, body):
+        url = urlsplit(target)
+        query = parse_qs(url.query)
+        path = url.path.rstrip('/')
+        if path == '/layout':
+            if method != 'POST':
+                return 405, {'error': 'method not allowed'}
+            try:
+                width = int(query.get('width', [800])[0])
+                height = int(query.get('height', [600])[0])
+                options = {}
+                if 'lazy_pairs' in query:
+                    options['lazy_pairs'] = int(query['lazy_pairs'][0])
+                    options['lazy_step'] = int(
+                        query.get('lazy_step', [100])[0])
+            except ValueError as e:
+                return 400, {'error': str(e)}
+            group_key = query.get('group_key', ['group'])[0]
+            try:
+                job = self.submit(body, width, height, group_key, options)
+            except asyncio.QueueFull:
+                return 503, {'error': 'queue is full'}
+            if query.get('wait', ['1'])[0] == '0':
+                return 202, job.describe()
+            await job.done.wait()
+            if job.status == 'done':
+                return 200, job.result
+            return job.code, job.describe()
+        if path.startswith('/jobs/'):
+            job = self.jobs.get(path[len('/jobs/'):])
+            if job is None:
+                return 404, {'error': 'job not found'}
+            if method == 'GET':
+                if job.status == 'done':
+                    return 200, job.result
+                if job.done.is_set():
+                    return job.code, job.describe()
+                return 202, job.describe()
+            if method == 'DELETE':
+                self.cancel(job)
+                return 200, job.describe()
+            return 405, {'error': 'method not allowed'}
+        if path == '/stats' and method == 'GET':
+            return 200, self.stats()
+        return 404, {'error': 'not found'}
+
+
+async def read_request(reader, writer):
+    line = await reader.readline()
+    if not line:
+        return None
+    method, target, _ = line.decode('latin-1').split(' ', 2)
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        key, value = line.decode('latin-1').split(':', 1)
+        headers[key.strip().lower()] = value.strip()
+    if headers.get('expect', '').lower() == '100-continue':
+        writer.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+        await writer.drain()
+    body = await reader.readexactly(int(headers.get('content-length', 0)))
+    return method, target, body
+
+
+async def write_response(writer, status, body):
+    if not isinstance(body, bytes):
+        body = json.dumps(body).encode()
+    writer.write('HTTP/1.1 {} {}\r\n'.format(status, STATUS_TEXT[status])
+                 .encode('latin-1'))
+    writer.write(b'Content-Type: application/json\r\n')
+    writer.write('Content-Length: {}\r\n'.format(len(body)).encode('latin-1'))
+    writer.write(b'Connection: close\r\n\r\n')
+    writer.write(body)
+    await writer.drain()
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--host', dest='host', default='127.0.0.1')
+    parser.add_argument('--port', dest='port', type=int, default=8000)
+    parser.add_argument('--socket', dest='socket')
+    parser.add_argument('--workers', dest='workers', type=int, default=1)
+    parser.add_argument('--queue-size', dest='queue_size', type=int,
+                        default=16)
+    args = parser.parse_args()
+
+    loop = asyncio.get_event_loop()
+    server = LayoutServer(args.workers, args.queue_size)
+    server.start()
+    if args.socket:
+        start = asyncio.start_unix_server(server.handle, path=args.socket)
+    else:
+        start = asyncio.start_server(server.handle, args.host, args.port)
+    loop.run_until_complete(start)
+    try:
+        loop.run_forever()
+    finally:
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -1,28 +1,167 @@
 import json
+import time
 import argparse
+from contextlib import contextmanager
+import networkx as nx
 from networkx.readwrite import json_graph
 from pyomo.opt import SolverFactory
 from nested_squarify import nested_squarify, nested_tree_structure
 from nested_squarify import nest, aggregate_sizes
 from define_model import Kx, K_group
 from define_model import define_model, get_x_coord, get_y_coord
+from define_model import cluster_graph, edge_weight
+from lazy_model import solve_lazy
+from node_layout import layout_nodes
+from binary_graph import BinaryGraph, is_binary_graph
+from multilevel import coarsen
+from layout_writer import FORMATS, write_layout
 
 
-def run(graph_data, width, height, outfile):
-    graph = json_graph.node_link_graph(graph_data)
+@contextmanager
+def phase(timings, name):
+    start = time.perf_counter()
+    yield
+    if timings is not None:
+        timings[name] = timings.get(name, 0) + time.perf_counter() - start
 
-    groups = graph_data['groups']
-    sizes = [0 for _ in groups]
-    for node in graph_data['nodes']:
-        sizes[node['group']] += 1
+
+def prepare(graph_data):
+    if isinstance(graph_data, BinaryGraph):
+        groups = graph_data.groups
+        sizes = graph_data.group_sizes()
+    else:
+        groups = graph_data['groups']
+        sizes = [0 for _ in groups]
+        for node in graph_data['nodes']:
+            sizes[node['group']] += 1
 
     children = nest([g['parent'] for g in groups])
     aggregate_sizes(groups, sizes, children, set())
     for i, g in enumerate(groups):
         children[i].sort(key=lambda k: sizes[k], reverse=True)
+    return sizes, children
+
+
+def find_root(groups):
+    return [(g, i) for i, g in enumerate(groups) if g['parent'] is None][0][1]
+
+
+def subtree_groups(children, root, depth=None, stop=()):
+    # rootから深さdepthで打ち切った部分木の葉へ各子孫グループを対応付ける
+    # stopに含まれるグループの子孫も打ち切る
+    group_map = {}
+    expanded = []
+
+    def rec(g, rep, level):
+        group_map[g] = rep
+        if (rep == g and children[g]
+                and (depth is None or level < depth)
+                and (level == 0 or g not in stop)):
+            expanded.append(g)
+            for c in children[g]:
+                rec(c, c, level + 1)
+        else:
+            for c in children[g]:
+                rec(c, rep, level + 1)
+
+    rec(root, root, 0)
+    return group_map, expanded
+
+
+def anchor_groups(children, root, placed):
+    '''rootの部分木の外の各グループを、それを含む最も深い配置済みのグループへ
+    対応付ける。rootの祖先は部分木全体を含むので除く'''
+    nested = {c for l in children for c in l}
+    top = [g for g in range(len(children)) if g not in nested]
+    parent = {c: p for p, l in enumerate(children) for c in l}
+    ancestors = set()
+    g = root
+    while g in parent:
+        g = parent[g]
+        ancestors.add(g)
+    result = {}
+
+    def rec(g, anchor):
+        if g == root:
+            return
+        if g in ancestors:
+            anchor = None
+        elif g in placed:
+            anchor = g
+        if anchor is not None:
+            result[g] = anchor
+        for c in children[g]:
+            rec(c, anchor)
+
+    for g in top:
+        rec(g, None)
+    return result
+
+
+def regroup_graph(graph, group_map):
+    if isinstance(graph, BinaryGraph):
+        return graph.regroup(group_map)
+    result = nx.Graph()
+    for u in graph.nodes():
+        g = graph.node[u]['group']
+        if g in group_map:
+            result.add_node(u, group=group_map[g])
+    for u, v, w in graph.edges(data='value', default=1):
+        if result.has_node(u) and result.has_node(v):
+            result.add_edge(u, v, value=w)
+    return result
+
+
+def solve(graph, K, lazy_pairs=None, lazy_step=100, tee=True, timings=None,
+          edges=None, anchors=()):
+    solver = SolverFactory('cbc')
+    if lazy_pairs is None:
+        with phase(timings, 'model'):
+            model = define_model(graph, K, edges=edges, anchors=anchors)
+        with phase(timings, 'solve'):
+            return model, [solver.solve(model, tee=tee, timelimit=300)]
+    with phase(timings, 'solve'):
+        return solve_lazy(graph, K, solver,
+                          initial_pairs=lazy_pairs, step=lazy_step,
+                          edges=edges, anchors=anchors,
+                          tee=tee, timelimit=300)
+
+
+def box_anchors(cgraph, K, x, y, placed):
+    '''配置済みのボックスとの辺を、(x, y)を原点とする中心座標で返す'''
+    anchors = []
+    for k in K.get_has_no_children():
+        if not cgraph.has_node(k.group):
+            continue
+        for h, w in cgraph[k.group].items():
+            if h in placed:
+                box = placed[h]
+                anchors.append((k.kid,
+                                box['x'] + box['dx'] / 2 - x,
+                                box['y'] + box['dy'] / 2 - y,
+                                w['weight']))
+    return anchors
+
 
-    boxes = nested_squarify(sizes, children, 0, 0, width, height)
-    tree = nested_tree_structure(boxes, children)
+def layout_subtree(graph, sizes, children, root, x, y, width, height,
+                   depth=None, stop=(), placed=None, timings=None, **options):
+    '''rootの部分木を配置する
+
+    placedに配置済みのグループのボックスを与えると、部分木の外への辺は
+    それらの位置に固定されたボックスへの辺として目的関数に含める
+    '''
+    with phase(timings, 'squarify'):
+        group_map, expanded = subtree_groups(children, root, depth, stop)
+        expanded = set(expanded)
+        sub_children = [l if i in expanded else []
+                        for i, l in enumerate(children)]
+
+        boxes = nested_squarify(sizes, sub_children, x, y, width, height,
+                                root=root)
+        tree = nested_tree_structure(boxes, sub_children)
+    result = {root: {'x': x, 'y': y, 'dx': width, 'dy': height, 'level': 0}}
+    if not tree:
+        return result, []
     K = K_group([Kx(
                     kid=i,
                     parent=obj['parent'],
@@ -32,34 +171,129 @@ def run(graph_data, width, height, outfile):
                     group=obj['box_id'] if 'box_id' in obj else None,
                     ) for i, obj in enumerate(tree)])
 
-    model = define_model(graph, K)
-    solver = SolverFactory('cbc')
-    result = solver.solve(model, tee=True, timelimit=300)
+    if not K.get_id_has_children():
+        # 子が一つだけの場合は最適化する順序がない
+        k = K[0]
+        result[k.group] = {'x': x, 'y': y, 'dx': k.width, 'dy': k.height,
+                           'level': boxes[k.group]['level']}
+        return result, []
+
+    with phase(timings, 'model'):
+        outside = {}
+        if placed:
+            anchor_map = anchor_groups(children, root, placed)
+            outside = {h: placed[h] for h in set(anchor_map.values())}
+            anchor_map.update(group_map)
+            group_map = anchor_map
+        # 付け替えるグループがなければグラフを複製しない
+        if outside or any(g != rep for g, rep in group_map.items()):
+            graph = regroup_graph(graph, group_map)
+        cgraph = cluster_graph(graph)
+        anchors = box_anchors(cgraph, K, x, y, outside)
 
+    if len(K.get_id_has_no_children()) == 2 and not anchors:
+        # 外部との辺がない2つの葉は左右を入れ替えても目的関数が変わらない
+        for k in K:
+            if k.group is None:
+                continue
+            box = boxes[k.group]
+            result[k.group] = {'x': box['x'], 'y': box['y'],
+                               'dx': k.width, 'dy': k.height,
+                               'level': box['level']}
+        return result, []
+
+    model, results = solve(graph, K, timings=timings,
+                           edges=edge_weight(graph, K, cgraph),
+                           anchors=anchors, **options)
     for k in K:
         j = k.kid
         g = k.group
         if g is not None:
-            groups[g]['x'] = get_x_coord(K, model, j)
-            groups[g]['y'] = get_y_coord(K, model, j)
-            groups[g]['dx'] = k.width
-            groups[g]['dy'] = k.height
+            result[g] = {
+                'x': x + get_x_coord(K, model, j),
+                'y': y + get_y_coord(K, model, j),
+                'dx': k.width,
+                'dy': k.height,
+                'level': boxes[g]['level'],
+            }
+    return result, results
+
+
+def layout_multilevel(graph, sizes, children, root, x, y, width, height,
+                      max_children, timings=None, **options):
+    depth = {root: 0}
+    queue = [root]
+    while queue:
+        g = queue.pop()
+        for c in children[g]:
+            depth[c] = depth[g] + 1
+            queue.append(c)
+
+    with phase(timings, 'coarsen'):
+        sizes = list(sizes)
+        children = [list(l) for l in children]
+        virtual = set(coarsen(graph, sizes, children, max_children))
+
+    # 粗い階層から順に仮想グループの内部を配置する
+    # 配置済みのグループは固定されたボックスとして向きを決める
+    boxes = {root: {'x': x, 'y': y, 'dx': width, 'dy': height, 'level': 0}}
+    results = []
+    queue = [root]
+    while queue:
+        g = queue.pop()
+        box = boxes[g]
+        sub_boxes, sub_results = layout_subtree(
+            graph, sizes, children, g, box['x'], box['y'], box['dx'],
+            box['dy'], stop=virtual, placed=boxes, timings=timings,
+            **options)
+        boxes.update(sub_boxes)
+        results.extend(sub_results)
+        queue.extend(v for v in sub_boxes if v in virtual and v != g)
+    return {g: dict(box, level=depth[g]) for g, box in boxes.items()
+            if g not in virtual}, results
+
+
+def apply_boxes(groups, boxes, margin=5):
+    for g, box in boxes.items():
+        groups[g]['x'] = box['x'] + margin * box['level']
+        groups[g]['y'] = box['y'] + margin * box['level']
+        groups[g]['dx'] = box['dx'] - 2 * margin * box['level']
+        groups[g]['dy'] = box['dy'] - 2 * margin * box['level']
 
-    root = [(g, i) for i, g in enumerate(groups) if g['parent'] is None][0][1]
-    groups[root]['x'] = 0
-    groups[root]['y'] = 0
-    groups[root]['dx'] = width
-    groups[root]['dy'] = height
 
-    margin = 5
-    for group, box in zip(groups, boxes):
-        group['x'] += margin * box['level']
-        group['y'] += margin * box['level']
-        group['dx'] -= 2 * margin * box['level']
-        group['dy'] -= 2 * margin * box['level']
+def run(graph_data, width, height, outfile=None, timings=None,
+        output_format='json', node_layout=False, processes=None,
+        max_children=None, **options):
+    if isinstance(graph_data, BinaryGraph) and node_layout:
+        raise ValueError('node layout requires node-link graph data')
+    with phase(timings, 'prepare'):
+        sizes, children = prepare(graph_data)
+        if isinstance(graph_data, BinaryGraph):
+            graph = graph_data
+            graph_data = {'groups': graph.groups}
+        else:
+            graph = json_graph.node_link_graph(graph_data)
+        groups = graph_data['groups']
+        root = find_root(groups)
+    if max_children is None:
+        boxes, results = layout_subtree(graph, sizes, children, root,
+                                        0, 0, width, height,
+                                        timings=timings, **options)
+    else:
+        boxes, results = layout_multilevel(graph, sizes, children, root,
+                                           0, 0, width, height, max_children,
+                                           timings=timings, **options)
+    apply_boxes(groups, boxes)
+    if node_layout:
+        with phase(timings, 'nodes'):
+            layout_nodes(graph_data, processes)
 
-    json.dump(graph_data, open(outfile, 'w'))
-    print('computation time: {}'.format(result.solver.time))
+    if outfile is not None:
+        with phase(timings, 'write'):
+            write_layout(outfile, graph_data, output_format)
+    print('computation time: {}'.format(
+        sum(result.solver.time for result in results)))
+    return graph_data
 
 
 def main():
@@ -69,12 +303,32 @@ def main():
     parser.add_argument('-f', dest='infile', required=True)
     parser.add_argument('-o', dest='outfile', required=True)
     parser.add_argument('--group-key', dest='group_key', default='group')
+    parser.add_argument('--format', dest='format', default='json',
+                        choices=FORMATS)
+    parser.add_argument('--lazy-pairs', dest='lazy_pairs', type=int)
+    parser.add_argument('--lazy-step', dest='lazy_step', type=int,
+                        default=100)
+    parser.add_argument('--node-layout', dest='node_layout',
+                        action='store_true')
+    parser.add_argument('--processes', dest='processes', type=int)
+    parser.add_argument('--max-children', dest='max_children', type=int)
     args = parser.parse_args()
+    if args.max_children is not None and args.max_children < 2:
+        parser.error('--max-children must be at least 2')
 
-    graph = json.load(open(args.infile))
-    for node in graph['nodes']:
-        node['group'] = node[args.group_key]
-    run(graph, args.width, args.height, args.outfile)
+    if is_binary_graph(args.infile):
+        if args.node_layout:
+            parser.error('--node-layout requires node-link JSON input')
+        graph = BinaryGraph(args.infile)
+    else:
+        graph = json.load(open(args.infile))
+        for node in graph['nodes']:
+            node['group'] = node[args.group_key]
+    run(graph, args.width, args.height, args.outfile,
+        output_format=args.format,
+        node_layout=args.node_layout, processes=args.processes,
+        max_children=args.max_children,
+        lazy_pairs=args.lazy_pairs, lazy_step=args.lazy_step)
 
 
 if __name__ == '__main__':